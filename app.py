@@ -1,9 +1,22 @@
 import os
+import json
+import hashlib
 import logging
+import re
+import orjson
+import redis
 import requests
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from requests.adapters import HTTPAdapter
+from rq import Queue
+from urllib3.util.retry import Retry
+from flask import Flask, render_template, request, redirect, url_for, flash, session, g, jsonify
+from flask.json.provider import DefaultJSONProvider, JSONProvider
+from flask_session import Session
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy import inspect, insert, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import DeclarativeBase, deferred, undefer
 from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
@@ -16,9 +29,34 @@ class Base(DeclarativeBase):
 
 db = SQLAlchemy(model_class=Base)
 
+class ORJSONProvider(JSONProvider):
+    """Flask JSON provider backed by orjson; keeps the default sorted-key output"""
+    options = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+    # Types orjson can't encode natively (e.g. Decimal) fall back to Flask's default rules
+    default = staticmethod(DefaultJSONProvider.default)
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.options).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        # Same argument rules as jsonify(): one value, several positional values, or keywords
+        if args and kwargs:
+            raise TypeError("app.json.response() takes either args or kwargs, not both")
+        if len(args) == 1:
+            obj = args[0]
+        else:
+            obj = args or kwargs or None
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self.options | orjson.OPT_APPEND_NEWLINE),
+            mimetype='application/json')
+
 # Create Flask app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "atlas-air-secret-key-dev")
+app.json = ORJSONProvider(app)
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
 # Database configuration
@@ -27,40 +65,103 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_recycle": 300,
     "pool_pre_ping": True,
 }
+# Production runs on Postgres. Each gunicorn worker process gets its own pool, and a
+# worker never runs more than WEB_THREADS requests at once, so the pool matches that
+# with no overflow. Total connections are workers * WEB_THREADS (see gunicorn.conf.py)
+# and must stay below the server's max_connections (100 by default).
+if app.config["SQLALCHEMY_DATABASE_URI"].startswith("postgresql"):
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"].update({
+        "pool_size": int(os.environ.get("WEB_THREADS", 8)),
+        "max_overflow": 0,
+        "connect_args": {"options": "-c jit=off"},  # JIT only slows down short OLTP queries
+    })
 db.init_app(app)
 
+# Redis for sessions and caching, when available
+redis_client = redis.from_url(os.environ["REDIS_URL"]) if os.environ.get("REDIS_URL") else None
+PILOT_CACHE_TTL = 30  # seconds
+LOGIN_MAX_ATTEMPTS = 5  # per username per window
+LOGIN_WINDOW = 60  # seconds
+
+# Server-side sessions in Redis when available, signed cookies otherwise
+if redis_client:
+    app.config["SESSION_TYPE"] = "redis"
+    app.config["SESSION_REDIS"] = redis_client
+    app.config["SESSION_REFRESH_EACH_REQUEST"] = False
+    Session(app)
+
+# Background jobs (Discord sync) run on an RQ worker when Redis is available
+discord_queue = Queue('discord', connection=redis_client) if redis_client else None
+
+# Shared HTTP session so Discord API calls reuse pooled keep-alive connections
+DISCORD_HTTP = requests.Session()
+DISCORD_HTTP.mount('https://', HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    # Retry only connection setup; a stalled read is not retried so a sync stays bounded
+    max_retries=Retry(total=2, connect=2, read=0, backoff_factor=0.2)
+))
+DISCORD_TIMEOUT = (3, 7)  # (connect, read) seconds
+
 # Pilot model
 class Pilot(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
-    password_hash = db.Column(db.String(256), nullable=False)
+    password_hash = deferred(db.Column(db.String(256), nullable=False))  # loaded only by login
     name = db.Column(db.String(100), nullable=False)
     callsign = db.Column(db.String(20), nullable=False)
     rank = db.Column(db.String(50), default='First Officer')
     balance = db.Column(db.Integer, default=25000)
     hours = db.Column(db.Integer, default=0)
     completed_flights = db.Column(db.Integer, default=0)
-    aircraft_owned = db.Column(db.Text, default='')  # Store as comma-separated string
     cargo_delivered = db.Column(db.Integer, default=0)
     status = db.Column(db.String(20), default='Active')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Ordered by id: the row table has no insertion order to preserve. Loaded on first
+    # access so requests that never read it don't pay for it.
+    aircraft = db.relationship('PilotAircraft', cascade='all, delete-orphan',
+                               order_by='PilotAircraft.aircraft_id')
+    stats = db.relationship('PilotStats', uselist=False)
+    
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(password, method='scrypt:32768:8:1')
     
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
     
+    @property
+    def aircraft_owned(self):
+        # Comma-separated view of owned items, kept for templates
+        return ', '.join(self.get_aircraft_list())
+    
     def get_aircraft_list(self):
-        if self.aircraft_owned:
-            return [item.strip() for item in self.aircraft_owned.split(',') if item.strip()]
-        return []
+        return [owned.aircraft_id for owned in self.aircraft]
+    
+    def set_aircraft(self, aircraft_ids):
+        # Keep rows that are still owned so only the difference is written
+        owned = {item.aircraft_id: item for item in self.aircraft}
+        self.aircraft = [owned.get(aircraft_id) or PilotAircraft(aircraft_id=aircraft_id)
+                         for aircraft_id in dict.fromkeys(aircraft_ids)]
+
+class PilotAircraft(db.Model):
+    pilot_id = db.Column(db.Integer, db.ForeignKey('pilot.id'), nullable=False)
+    aircraft_id = db.Column(db.Text, nullable=False)  # SHOP_ITEMS id, or whatever the Discord bot sends
     
-    def add_aircraft(self, aircraft_id):
-        current_aircraft = self.get_aircraft_list()
-        if aircraft_id not in current_aircraft:
-            current_aircraft.append(aircraft_id)
-            self.aircraft_owned = ', '.join(current_aircraft)
+    __table_args__ = (
+        db.PrimaryKeyConstraint('pilot_id', 'aircraft_id'),
+        db.Index('ix_pilot_aircraft', 'pilot_id'),
+    )
+
+class PilotStats(db.Model):
+    """Running totals over a pilot's completed flights, updated as flights end"""
+    pilot_id = db.Column(db.Integer, db.ForeignKey('pilot.id'), primary_key=True)
+    total_seconds = db.Column(db.BigInteger, nullable=False, default=0)
+    total_cargo = db.Column(db.BigInteger, nullable=False, default=0)  # tons
+    last_updated = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Dialect-specific INSERT constructs that support ON CONFLICT upserts
+UPSERT_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
 
 class FlightLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -77,11 +178,40 @@ class FlightLog(db.Model):
     completed_at = db.Column(db.DateTime, nullable=True)
     
     pilot = db.relationship('Pilot', backref='flight_logs')
+    
+    __table_args__ = (
+        db.Index('ix_flightlog_pilot_dep', 'pilot_id', db.desc('departure_time')),
+    )
+
+def backfill_aircraft_owned():
+    """Move the legacy comma-separated pilot.aircraft_owned column into pilot_aircraft"""
+    pilot_columns = {column['name'] for column in inspect(db.engine).get_columns(Pilot.__tablename__)}
+    if 'aircraft_owned' not in pilot_columns:
+        return
+    
+    legacy = db.session.execute(
+        text("SELECT id, aircraft_owned FROM pilot WHERE aircraft_owned IS NOT NULL AND aircraft_owned != ''")
+    ).all()
+    rows = [
+        {'pilot_id': pilot_id, 'aircraft_id': aircraft_id}
+        for pilot_id, aircraft_owned in legacy
+        for aircraft_id in dict.fromkeys(item.strip() for item in aircraft_owned.split(','))
+        if aircraft_id
+    ]
+    if rows:
+        dialect_insert = UPSERT_INSERTS[db.session.get_bind().dialect.name]
+        db.session.execute(dialect_insert(PilotAircraft).on_conflict_do_nothing(), rows)
+    # Clear the copied values so a later init-db can't re-add aircraft sold or synced away since
+    db.session.execute(text("UPDATE pilot SET aircraft_owned = NULL WHERE aircraft_owned IS NOT NULL"))
+    db.session.commit()
+    logging.info(f"Backfilled {len(rows)} owned aircraft from pilot.aircraft_owned")
 
-with app.app_context():
+def init_db():
+    """Create tables, migrate legacy data and seed the sample pilot on an empty database"""
     db.create_all()
+    backfill_aircraft_owned()
     # Create a sample pilot if none exist
-    if not Pilot.query.first():
+    if not db.session.execute(select(Pilot.id).limit(1)).first():
         sample_pilot = Pilot(
             username='pilot001',
             name='Captain John Smith',
@@ -90,9 +220,9 @@ with app.app_context():
             balance=45000,
             hours=0,
             completed_flights=0,
-            cargo_delivered=0,
-            aircraft_owned='boeing_767, boeing_777'
+            cargo_delivered=0
         )
+        sample_pilot.set_aircraft(['boeing_767', 'boeing_777'])
         sample_pilot.set_password('password123')
         db.session.add(sample_pilot)
         db.session.commit()
@@ -101,20 +231,49 @@ with app.app_context():
         # No sample flight logs - pilot starts fresh
         logging.info("Fresh pilot account created - ready for first flight")
 
+@app.cli.command('init-db')
+def init_db_command():
+    """Create database tables and the sample pilot"""
+    init_db()
+
+# Workers skip schema setup; set FLASK_AUTO_INIT=1 to bootstrap on import in development
+if os.environ.get('FLASK_AUTO_INIT') == '1':
+    with app.app_context():
+        init_db()
+
+SESSIONLESS_ENDPOINTS = ('api_catalog', 'static')
+
 # Clear any invalid session data on startup
 @app.before_request
 def clear_invalid_sessions():
+    # Shared, cacheable responses: don't touch the session (that adds Vary: Cookie) or the DB
+    if request.endpoint in SESSIONLESS_ENDPOINTS:
+        return
     if 'pilot_id' in session:
         # Check if the pilot_id is valid
         try:
             pilot_id = int(session['pilot_id'])
-            pilot = Pilot.query.get(pilot_id)
+            pilot = db.session.get(Pilot, pilot_id)
             if not pilot:
                 session.clear()
+            # Cache the pilot for the rest of the request so views don't re-query it
+            g.pilot = pilot
         except (ValueError, TypeError):
             # Invalid pilot_id format, clear session
             session.clear()
 
+def current_pilot():
+    """Return the pilot loaded for this request by clear_invalid_sessions"""
+    return getattr(g, 'pilot', None)
+
+def pilot_cache_key(pilot_id):
+    return f'pilot:{pilot_id}:json'
+
+def invalidate_pilot_cache(pilot_id):
+    """Drop the cached API response for a pilot after their data changes"""
+    if redis_client:
+        redis_client.delete(pilot_cache_key(pilot_id))
+
 # Remove old session initialization function as we now use database authentication
 
 # Shop items data
@@ -213,6 +372,12 @@ SHOP_ITEMS = {
     ]
 }
 
+# Shop items keyed by id for direct lookup
+SHOP_INDEX = {item['id']: item for category in SHOP_ITEMS.values() for item in category}
+
+# Flight numbers are logged as GTI_ followed by 4-16 characters (fits FlightLog.flight_number)
+FLIGHT_NO_RE = re.compile(r'GTI_[A-Z0-9]{4,16}')
+
 # Available flights data (inspired by real Atlas Air website)
 AVAILABLE_FLIGHTS = [
     {
@@ -267,6 +432,10 @@ AVAILABLE_FLIGHTS = [
     }
 ]
 
+# Catalog data never changes at runtime, so serialize it once at import
+CATALOG_JSON = json.dumps({'shop': SHOP_ITEMS, 'flights': AVAILABLE_FLIGHTS}, separators=(',', ':')).encode()
+CATALOG_ETAG = hashlib.blake2b(CATALOG_JSON, digest_size=8).hexdigest()
+
 @app.route('/')
 def home():
     if 'pilot_id' in session:
@@ -279,9 +448,26 @@ def login():
         username = request.form['username']
         password = request.form['password']
         
-        pilot = Pilot.query.filter_by(username=username).first()
+        # Throttle repeated attempts before running the password hash
+        if redis_client:
+            attempts_key = f'login:{username}'
+            # Create the counter with its TTL, then increment, in one MULTI so the key
+            # never exists without an expiry (INCR keeps the TTL)
+            pipe = redis_client.pipeline(transaction=True)
+            pipe.set(attempts_key, 0, ex=LOGIN_WINDOW, nx=True)
+            pipe.incr(attempts_key)
+            _, attempts = pipe.execute()
+            if attempts > LOGIN_MAX_ATTEMPTS:
+                flash('Too many login attempts. Please wait a minute and try again.', 'error')
+                return render_template('login.html'), 429
+        
+        pilot = db.session.execute(
+            select(Pilot).filter_by(username=username).options(undefer(Pilot.password_hash))
+        ).scalar_one_or_none()
         
         if pilot and pilot.check_password(password):
+            if redis_client:
+                redis_client.delete(attempts_key)
             session['pilot_id'] = pilot.id
             flash('Login successful!', 'success')
             return redirect(url_for('dashboard'))
@@ -301,7 +487,7 @@ def dashboard():
     if 'pilot_id' not in session:
         return redirect(url_for('login'))
     
-    pilot = Pilot.query.get(session['pilot_id'])
+    pilot = current_pilot()
     if not pilot:
         session.pop('pilot_id', None)
         return redirect(url_for('login'))
@@ -313,7 +499,7 @@ def shop():
     if 'pilot_id' not in session:
         return redirect(url_for('login'))
     
-    pilot = Pilot.query.get(session['pilot_id'])
+    pilot = current_pilot()
     return render_template('shop.html', shop_items=SHOP_ITEMS, pilot=pilot)
 
 @app.route('/flights')
@@ -321,7 +507,7 @@ def flights():
     if 'pilot_id' not in session:
         return redirect(url_for('login'))
     
-    pilot = Pilot.query.get(session['pilot_id'])
+    pilot = current_pilot()
     return render_template('flights.html', flights=AVAILABLE_FLIGHTS, pilot=pilot)
 
 @app.route('/purchase/<item_id>')
@@ -329,36 +515,43 @@ def purchase(item_id):
     if 'pilot_id' not in session:
         return redirect(url_for('login'))
     
-    pilot = Pilot.query.get(session['pilot_id'])
+    pilot = current_pilot()
     
     # Find the item in shop
-    item = None
-    for category in SHOP_ITEMS.values():
-        for shop_item in category:
-            if shop_item['id'] == item_id:
-                item = shop_item
-                break
-        if item:
-            break
+    item = SHOP_INDEX.get(item_id)
     
     if not item:
         flash('Item not found!', 'error')
         return redirect(url_for('shop'))
     
     # Check if already owned
-    if item_id in pilot.get_aircraft_list():
+    owned = db.session.execute(
+        select(PilotAircraft.aircraft_id).filter_by(pilot_id=pilot.id, aircraft_id=item_id)
+    ).first()
+    if owned:
         flash(f'You already own {item["name"]}!', 'warning')
         return redirect(url_for('shop'))
     
-    # Check if pilot has enough balance
-    if pilot.balance < item['price']:
+    # Debit only if funds are sufficient, in the same statement as the check
+    debited = db.session.execute(
+        update(Pilot)
+        .where(Pilot.id == pilot.id, Pilot.balance >= item['price'])
+        .values(balance=Pilot.balance - item['price'])
+    ).rowcount
+    if not debited:
+        db.session.rollback()
         flash(f'Insufficient funds! You need ${item["price"]:,} but only have ${pilot.balance:,}', 'error')
         return redirect(url_for('shop'))
     
-    # Process purchase
-    pilot.balance -= item['price']
-    pilot.add_aircraft(item_id)
-    db.session.commit()
+    # The primary key rejects a concurrent duplicate purchase; rolling back refunds the debit
+    try:
+        db.session.execute(insert(PilotAircraft).values(pilot_id=pilot.id, aircraft_id=item_id))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        flash(f'You already own {item["name"]}!', 'warning')
+        return redirect(url_for('shop'))
+    invalidate_pilot_cache(pilot.id)
     
     flash(f'Successfully purchased {item["name"]} for ${item["price"]:,}!', 'success')
     return redirect(url_for('shop'))
@@ -368,64 +561,80 @@ def inventory():
     if 'pilot_id' not in session:
         return redirect(url_for('login'))
     
-    pilot = Pilot.query.get(session['pilot_id'])
+    pilot = current_pilot()
     
     # Get owned items details
-    owned_items = []
-    for item_id in pilot.get_aircraft_list():
-        for category in SHOP_ITEMS.values():
-            for shop_item in category:
-                if shop_item['id'] == item_id:
-                    owned_items.append(shop_item)
-                    break
+    owned_items = [SHOP_INDEX[item_id] for item_id in pilot.get_aircraft_list() if item_id in SHOP_INDEX]
     
     return render_template('inventory.html', owned_items=owned_items, pilot=pilot)
 
-@app.route('/sync-discord/<discord_user_id>')
-def sync_discord_stats(discord_user_id):
-    """Sync pilot stats from Discord bot API"""
-    if 'pilot_id' not in session:
-        return redirect(url_for('login'))
-    
-    pilot = Pilot.query.get(session['pilot_id'])
-    
+def sync_discord_pilot(pilot_id, discord_user_id):
+    """Pull a pilot's stats from the Discord bot API; returns an error message or None"""
     # Discord bot API endpoint - replace with your actual Discord bot API
     # Format should be: https://your-bot-domain.com/api/stats/{discord_user_id}
     discord_api_url = f"https://your-discord-bot-api.com/api/stats/{discord_user_id}"
     
     try:
         # Make API request to Discord bot
-        response = requests.get(discord_api_url, timeout=10)
-        
-        if response.status_code == 200:
-            discord_data = response.json()
-            
-            # Update pilot stats with Discord data
-            pilot.balance = discord_data.get('balance', pilot.balance)
-            pilot.hours = discord_data.get('flight_hours', pilot.hours)
-            pilot.completed_flights = discord_data.get('completed_flights', pilot.completed_flights)
-            pilot.cargo_delivered = discord_data.get('cargo_delivered', pilot.cargo_delivered)
-            pilot.rank = discord_data.get('rank', pilot.rank)
-            
-            # Update username from Discord
-            discord_username = discord_data.get('username')
-            if discord_username:
-                pilot.name = discord_username
-            
-            # Update aircraft fleet
-            discord_aircraft = discord_data.get('aircraft_owned', [])
-            if discord_aircraft:
-                pilot.aircraft_owned = ', '.join(discord_aircraft)
-            
-            db.session.commit()
-            flash('Successfully synced stats from Discord bot!', 'success')
-            
-        else:
-            flash(f'Failed to sync from Discord bot. Status: {response.status_code}', 'error')
-            
+        response = DISCORD_HTTP.get(discord_api_url, timeout=DISCORD_TIMEOUT)
+        if response.status_code != 200:
+            return f'Failed to sync from Discord bot. Status: {response.status_code}'
+        discord_data = response.json()
     except requests.exceptions.RequestException as e:
-        flash(f'Error connecting to Discord bot API: {str(e)}', 'error')
         logging.error(f"Discord API error: {e}")
+        return f'Error connecting to Discord bot API: {str(e)}'
+    
+    pilot = db.session.get(Pilot, pilot_id)
+    if not pilot:
+        return 'Pilot not found'
+    
+    # Update pilot stats with Discord data
+    pilot.balance = discord_data.get('balance', pilot.balance)
+    pilot.hours = discord_data.get('flight_hours', pilot.hours)
+    pilot.completed_flights = discord_data.get('completed_flights', pilot.completed_flights)
+    pilot.cargo_delivered = discord_data.get('cargo_delivered', pilot.cargo_delivered)
+    pilot.rank = discord_data.get('rank', pilot.rank)
+    
+    # Update username from Discord
+    discord_username = discord_data.get('username')
+    if discord_username:
+        pilot.name = discord_username
+    
+    # Update aircraft fleet
+    discord_aircraft = discord_data.get('aircraft_owned', [])
+    if discord_aircraft:
+        pilot.set_aircraft(discord_aircraft)
+    
+    db.session.commit()
+    invalidate_pilot_cache(pilot.id)
+    return None
+
+def sync_discord_worker(pilot_id, discord_user_id):
+    """RQ job entry point for sync_discord_pilot"""
+    with app.app_context():
+        error = sync_discord_pilot(pilot_id, discord_user_id)
+        if error:
+            logging.error(f"Discord sync failed for pilot {pilot_id}: {error}")
+
+@app.route('/sync-discord/<discord_user_id>')
+def sync_discord_stats(discord_user_id):
+    """Sync pilot stats from Discord bot API"""
+    if 'pilot_id' not in session:
+        return redirect(url_for('login'))
+    
+    pilot = current_pilot()
+    
+    # Hand off to a worker so the request doesn't wait on the Discord API
+    if discord_queue:
+        discord_queue.enqueue(sync_discord_worker, pilot.id, discord_user_id)
+        flash('Discord sync queued. Your stats will update shortly.', 'info')
+        return redirect(url_for('dashboard'))
+    
+    error = sync_discord_pilot(pilot.id, discord_user_id)
+    if error:
+        flash(error, 'error')
+    else:
+        flash('Successfully synced stats from Discord bot!', 'success')
     
     return redirect(url_for('dashboard'))
 
@@ -435,8 +644,12 @@ def flight_logs():
     if 'pilot_id' not in session:
         return redirect(url_for('login'))
     
-    pilot = Pilot.query.get(session['pilot_id'])
-    logs = FlightLog.query.filter_by(pilot_id=pilot.id).order_by(FlightLog.departure_time.desc()).all()
+    pilot = current_pilot()
+    logs = db.session.execute(
+        select(FlightLog)
+        .where(FlightLog.pilot_id == pilot.id)
+        .order_by(FlightLog.departure_time.desc())
+    ).scalars().all()
     
     return render_template('flight_logs.html', pilot=pilot, flight_logs=logs)
 
@@ -446,20 +659,20 @@ def add_flight_log():
     if 'pilot_id' not in session:
         return redirect(url_for('login'))
     
-    pilot = Pilot.query.get(session['pilot_id'])
+    pilot = current_pilot()
     
     if request.method == 'POST':
         try:
             # Parse form data
-            flight_number = request.form.get('flight_number')
+            flight_number = request.form.get('flight_number', '').strip().upper()
             aircraft_type = request.form.get('aircraft_type')
             departure_airport = request.form.get('departure_airport', '').upper()
             arrival_airport = request.form.get('arrival_airport', '').upper()
             cargo_type = request.form.get('cargo_type')
-            departure_time_str = request.form.get('departure_time')
+            departure_time_str = request.form.get('departure_time', '')
             
             # Validate flight number format (GTI_1234)
-            if not flight_number.startswith('GTI_') or len(flight_number) < 5:
+            if not FLIGHT_NO_RE.fullmatch(flight_number):
                 flash('Flight number must be in GTI_XXXX format', 'error')
                 return redirect(url_for('add_flight_log'))
             
@@ -486,9 +699,14 @@ def add_flight_log():
             flash('Flight log created! Starting flight tracking...', 'success')
             return redirect(url_for('flight_tracker', log_id=new_log.id))
             
-        except Exception as e:
+        except ValueError as e:
             flash(f'Error adding flight log: {str(e)}', 'error')
             logging.error(f"Flight log error: {e}")
+        except SQLAlchemyError as e:
+            # Failed insert; reset the session and keep SQL details out of the page
+            db.session.rollback()
+            flash('Error adding flight log. Please check the form and try again.', 'error')
+            logging.error(f"Flight log error: {e}")
     
     # Aircraft options for our fleet
     aircraft_options = [
@@ -518,8 +736,8 @@ def flight_tracker(log_id):
     if 'pilot_id' not in session:
         return redirect(url_for('login'))
     
-    pilot = Pilot.query.get(session['pilot_id'])
-    flight_log = FlightLog.query.get_or_404(log_id)
+    pilot = current_pilot()
+    flight_log = db.get_or_404(FlightLog, log_id)
     
     # Ensure this flight belongs to the logged-in pilot
     if flight_log.pilot_id != pilot.id:
@@ -534,7 +752,7 @@ def pause_flight(log_id):
     if 'pilot_id' not in session:
         return {'error': 'Unauthorized'}, 401
     
-    flight_log = FlightLog.query.get_or_404(log_id)
+    flight_log = db.get_or_404(FlightLog, log_id)
     if flight_log.pilot_id != session['pilot_id']:
         return {'error': 'Unauthorized'}, 401
     
@@ -549,7 +767,7 @@ def resume_flight(log_id):
     if 'pilot_id' not in session:
         return {'error': 'Unauthorized'}, 401
     
-    flight_log = FlightLog.query.get_or_404(log_id)
+    flight_log = db.get_or_404(FlightLog, log_id)
     if flight_log.pilot_id != session['pilot_id']:
         return {'error': 'Unauthorized'}, 401
     
@@ -564,28 +782,57 @@ def end_flight(log_id):
     if 'pilot_id' not in session:
         return {'error': 'Unauthorized'}, 401
     
-    pilot = Pilot.query.get(session['pilot_id'])
-    flight_log = FlightLog.query.get_or_404(log_id)
-    
-    if flight_log.pilot_id != pilot.id:
-        return {'error': 'Unauthorized'}, 401
-    
+    pilot_id = current_pilot().id
     data = request.get_json()
     flight_duration_seconds = data.get('duration', 0)
-    
-    # Update flight log
-    flight_log.status = 'Completed'
-    flight_log.flight_duration = flight_duration_seconds
-    flight_log.completed_at = datetime.utcnow()
+    completed_at = datetime.utcnow()
+    
+    # Update flight log; the pilot_id guard doubles as the ownership check
+    completed = db.session.execute(
+        update(FlightLog)
+        .where(FlightLog.id == log_id, FlightLog.pilot_id == pilot_id)
+        .values(status='Completed', flight_duration=flight_duration_seconds, completed_at=completed_at)
+        .returning(FlightLog.id)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if not completed:
+        db.session.rollback()
+        db.get_or_404(FlightLog, log_id)
+        return {'error': 'Unauthorized'}, 401
     
     # Update pilot stats
     flight_hours = flight_duration_seconds / 3600  # Convert seconds to hours
-    pilot.hours += int(flight_hours)
-    pilot.completed_flights += 1
-    pilot.cargo_delivered += 50  # Default 50 tons per flight
-    pilot.balance += 50  # $50 reward per flight
+    db.session.execute(
+        update(Pilot)
+        .where(Pilot.id == pilot_id)
+        .values(
+            hours=Pilot.hours + int(flight_hours),
+            completed_flights=Pilot.completed_flights + 1,
+            cargo_delivered=Pilot.cargo_delivered + 50,  # Default 50 tons per flight
+            balance=Pilot.balance + 50  # $50 reward per flight
+        )
+        .execution_options(synchronize_session=False)
+    )
+    
+    # Fold this flight into the running totals in one upsert
+    dialect_insert = UPSERT_INSERTS[db.session.get_bind().dialect.name]
+    stats_insert = dialect_insert(PilotStats).values(
+        pilot_id=pilot_id,
+        total_seconds=int(flight_duration_seconds),
+        total_cargo=50,
+        last_updated=completed_at
+    )
+    db.session.execute(stats_insert.on_conflict_do_update(
+        index_elements=[PilotStats.pilot_id],
+        set_={
+            'total_seconds': PilotStats.total_seconds + stats_insert.excluded.total_seconds,
+            'total_cargo': PilotStats.total_cargo + stats_insert.excluded.total_cargo,
+            'last_updated': stats_insert.excluded.last_updated
+        }
+    ))
     
     db.session.commit()
+    invalidate_pilot_cache(pilot_id)
     
     return {
         'status': 'completed', 
@@ -597,14 +844,30 @@ def end_flight(log_id):
         'redirect_url': url_for('flight_logs')
     }
 
+@app.route('/api/catalog')
+def api_catalog():
+    """Static shop and flight catalog; cacheable forever when requested with ?v=<etag>"""
+    response = app.response_class(CATALOG_JSON, mimetype='application/json')
+    response.set_etag(CATALOG_ETAG)
+    if request.args.get('v') == CATALOG_ETAG:
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'public, no-cache'
+    return response.make_conditional(request)
+
 @app.route('/api/pilot/<int:pilot_id>')
 def api_get_pilot(pilot_id):
     """API endpoint to get pilot data (for Discord bot integration)"""
-    pilot = Pilot.query.get(pilot_id)
+    if redis_client:
+        cached = redis_client.get(pilot_cache_key(pilot_id))
+        if cached:
+            return app.response_class(cached, mimetype='application/json')
+    
+    pilot = db.session.get(Pilot, pilot_id)
     if not pilot:
         return {'error': 'Pilot not found'}, 404
     
-    return {
+    response = jsonify({
         'id': pilot.id,
         'username': pilot.username,
         'name': pilot.name,
@@ -616,13 +879,16 @@ def api_get_pilot(pilot_id):
         'cargo_delivered': pilot.cargo_delivered,
         'aircraft_owned': pilot.get_aircraft_list(),
         'status': pilot.status,
-        'created_at': pilot.created_at.isoformat() if pilot.created_at else None
-    }
+        'created_at': pilot.created_at
+    })
+    if redis_client:
+        redis_client.setex(pilot_cache_key(pilot_id), PILOT_CACHE_TTL, response.get_data())
+    return response
 
 @app.route('/api/pilot/<int:pilot_id>/update', methods=['POST'])
 def api_update_pilot(pilot_id):
     """API endpoint to update pilot data from Discord bot"""
-    pilot = Pilot.query.get(pilot_id)
+    pilot = db.session.get(Pilot, pilot_id)
     if not pilot:
         return {'error': 'Pilot not found'}, 404
     
@@ -641,11 +907,12 @@ def api_update_pilot(pilot_id):
         pilot.rank = data['rank']
     if 'aircraft_owned' in data:
         if isinstance(data['aircraft_owned'], list):
-            pilot.aircraft_owned = ', '.join(data['aircraft_owned'])
+            pilot.set_aircraft(data['aircraft_owned'])
         else:
-            pilot.aircraft_owned = data['aircraft_owned']
+            pilot.set_aircraft(item.strip() for item in data['aircraft_owned'].split(',') if item.strip())
     
     db.session.commit()
+    invalidate_pilot_cache(pilot.id)
     
     return {'message': 'Pilot updated successfully', 'pilot': {
         'id': pilot.id,
@@ -658,4 +925,5 @@ def api_update_pilot(pilot_id):
     }}
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Development server only; production runs under gunicorn via wsgi.py
+    app.run(host='0.0.0.0', port=5000, debug=os.environ.get('FLASK_ENV') == 'development')
@@ -0,0 +1,14 @@
+import multiprocessing
+import os
+
+# Gunicorn settings, picked up automatically when started from this directory
+bind = "0.0.0.0:5000"
+# Threads let a worker keep serving while requests wait on the database or Discord API
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", 8))
+# Each worker holds a database pool of `threads` connections (see app.py), so the app
+# opens up to workers * threads connections in total. The default keeps that within
+# ~90 to leave headroom under Postgres's default max_connections=100 for the RQ worker
+# and admin sessions; raise WEB_CONCURRENCY only together with max_connections.
+workers = int(os.environ.get(
+    "WEB_CONCURRENCY", min(multiprocessing.cpu_count() * 2 + 1, max(1, 90 // threads))))
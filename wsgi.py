@@ -0,0 +1,3 @@
+# WSGI entry point for production: gunicorn wsgi:app (settings in gunicorn.conf.py)
+# Run `flask --app app init-db` first on every deploy; see README.md.
+from app import app